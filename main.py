@@ -1,12 +1,21 @@
+import asyncio
+import hashlib
 import modal
 import os
+import re
+import uuid
+from datetime import datetime, timedelta, timezone
+from functools import lru_cache
+import httpx
 from pydantic import BaseModel
+from cachetools import TTLCache
 from fastapi import Request, HTTPException, FastAPI
+from fastapi.responses import ORJSONResponse
 from supabase import create_client, Client
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings
 
-web_app = FastAPI()
+web_app = FastAPI(default_response_class=ORJSONResponse)
 
 crawl4ai_image = (
     modal.Image.debian_slim(python_version="3.10")
@@ -17,9 +26,16 @@ crawl4ai_image = (
         "supabase",
         "langchain_text_splitters",
         "langchain-openai",
+        "cachetools",
+        "httpx[http2]",
+        "orjson",
     )
 )
 
+# Resolved once at container start; crawl4ai only exists inside the image
+with crawl4ai_image.imports():
+    from crawl4ai import AsyncWebCrawler, BrowserConfig, CrawlerRunConfig, CacheMode
+
 app = modal.App(
     name="supavec-api",
     image=crawl4ai_image,
@@ -27,21 +43,301 @@ app = modal.App(
 )
 
 
+@lru_cache(maxsize=1)
+def get_supabase() -> Client:
+    """Return a cached Supabase client shared across requests in this container."""
+    SUPABASE_URL = os.environ.get("SUPABASE_URL")
+    SUPABASE_KEY = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
+    return create_client(SUPABASE_URL, SUPABASE_KEY)
+
+
+@lru_cache(maxsize=1)
+def get_http_client() -> httpx.AsyncClient:
+    """Return a cached HTTP/2 client so outbound calls share warm TLS sessions."""
+    return httpx.AsyncClient(
+        http2=True,
+        timeout=30,
+        limits=httpx.Limits(max_keepalive_connections=32, max_connections=64),
+    )
+
+
+@lru_cache(maxsize=16)
+def get_splitter(chunk_size: int, chunk_overlap: int) -> RecursiveCharacterTextSplitter:
+    """Return a cached splitter for a chunking shape; only a couple are ever used."""
+    return RecursiveCharacterTextSplitter(
+        chunk_size=chunk_size, chunk_overlap=chunk_overlap
+    )
+
+
+@lru_cache(maxsize=1)
+def get_embeddings() -> OpenAIEmbeddings:
+    """Return a cached embeddings client so its httpx pool is reused."""
+    return OpenAIEmbeddings(
+        model="text-embedding-3-small",
+        http_async_client=get_http_client(),
+    )
+
+
+# Successful API-key validations cached for 5 minutes, keyed by a hash so raw
+# keys are never held in memory.
+_api_key_cache: TTLCache = TTLCache(maxsize=10_000, ttl=300)
+_api_key_locks: dict[str, asyncio.Lock] = {}
+
+
+def _hash_api_key(token: str) -> str:
+    return hashlib.blake2b(token.encode(), digest_size=16).hexdigest()
+
+
+async def validate_api_key(token: str) -> dict:
+    """Resolve team_id/user_id for an API key, hitting Supabase only on cache miss."""
+    cache_key = _hash_api_key(token)
+    cached = _api_key_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    lock = _api_key_locks.setdefault(cache_key, asyncio.Lock())
+    try:
+        async with lock:
+            cached = _api_key_cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+            supabase = get_supabase()
+            # supabase-py is synchronous; keep the query off the event loop.
+            # Only the two columns we use, and maybe_single() so zero rows
+            # comes back as no data instead of a PostgREST error.
+            response = await asyncio.to_thread(
+                lambda: supabase.table("api_keys")
+                .select("team_id, user_id")
+                .eq("api_key", token)
+                .maybe_single()
+                .execute()
+            )
+
+            if response is None or not response.data or not response.data.get("team_id"):
+                _api_key_cache.pop(cache_key, None)
+                raise HTTPException(status_code=401, detail="Invalid API key")
+
+            key_data = {
+                "team_id": response.data["team_id"],
+                "user_id": response.data["user_id"],
+            }
+            _api_key_cache[cache_key] = key_data
+            return key_data
+    finally:
+        _api_key_locks.pop(cache_key, None)
+
+
+# Completed scrapes can be reused for a week per (team, url, chunking shape)
+SCRAPE_CACHE_TTL = timedelta(weeks=1)
+
+
+def _scrape_cache_key(
+    team_id: str, url: str, chunk_size: int, chunk_overlap: int
+) -> str:
+    raw = f"{team_id}|{url}|{chunk_size}|{chunk_overlap}"
+    return hashlib.blake2b(raw.encode(), digest_size=16).hexdigest()
+
+
+async def lookup_scrape_cache(cache_key: str) -> dict | None:
+    """Return a prior scrape for this key if one finished within the TTL."""
+    supabase = get_supabase()
+    cutoff = (datetime.now(timezone.utc) - SCRAPE_CACHE_TTL).isoformat()
+    try:
+        response = await asyncio.to_thread(
+            lambda: supabase.table("scrape_cache")
+            .select("file_id, storage_path")
+            .eq("cache_key", cache_key)
+            .gte("created_at", cutoff)
+            .maybe_single()
+            .execute()
+        )
+    except Exception as e:
+        # A broken cache should never block a scrape
+        print(f"Warning: scrape cache lookup failed: {str(e)}")
+        return None
+
+    if response is None or not response.data:
+        return None
+    return response.data
+
+
+# Canonical 8-4-4-4-12 UUID form; cheaper than uuid.UUID's parse-and-raise
+_UUID_RE = re.compile(
+    r"\A[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}"
+    r"-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}\Z"
+)
+
+
 class ScrapeRequest(BaseModel):
     url: str
     chunk_size: int | None = 1500
     chunk_overlap: int | None = 20
 
 
+# Recycle the browser after this many pages to avoid Chromium memory growth
+MAX_USES_PER_INSTANCE = 50
+
+# Chunks per embeddings request, and a cap on in-flight requests so huge
+# documents don't trigger OpenAI 429 backoff or hold every vector at once
+EMBED_BATCH_SIZE = 256
+EMBED_MAX_CONCURRENCY = 8
+
+
+@app.cls(image=crawl4ai_image, container_idle_timeout=300, concurrency_limit=8)
+class Scraper:
+    """Holds a long-lived crawl4ai browser so warm containers skip Chromium startup."""
+
+    @modal.enter()
+    async def _open(self):
+        # text_mode/light_mode skip images, heavy styling and background
+        # features we never need since only the markdown is kept
+        self.crawler = await AsyncWebCrawler(
+            config=BrowserConfig(headless=True, text_mode=True, light_mode=True)
+        ).__aenter__()
+        self._uses = 0
+
+    @modal.exit()
+    async def _close(self):
+        await self.crawler.__aexit__(None, None, None)
+
+    @modal.method()
+    async def crawl(self, url: str) -> str:
+        if self._uses >= MAX_USES_PER_INSTANCE:
+            await self._close()
+            await self._open()
+        self._uses += 1
+
+        result = await self.crawler.arun(
+            url,
+            config=CrawlerRunConfig(
+                cache_mode=CacheMode.BYPASS,
+                page_timeout=80000,
+            ),
+        )
+        return result.markdown
+
+
+@app.function()
+async def persist_scrape(
+    team_id: str,
+    file_id: str,
+    markdown: str,
+    url: str,
+    chunk_size: int,
+    chunk_overlap: int,
+    cache_key: str,
+):
+    """Background task: upload the markdown and write the documents/files rows."""
+    supabase = get_supabase()
+    file_name = f"{file_id}.txt"
+
+    text_splitter = get_splitter(chunk_size, chunk_overlap)
+
+    chunks = text_splitter.create_documents(
+        texts=[markdown],
+        metadatas=[{"source": url, "file_id": file_id}],
+    )
+
+    # Encode once and reuse the same bytes for the upload; storage3 only
+    # accepts bytes or file objects, anything else is treated as a path
+    markdown_bytes = markdown.encode("utf-8")
+
+    embeddings = get_embeddings()
+
+    file_data = {
+        "file_id": file_id,
+        "type": "web_scrape",
+        "file_name": file_name,
+        "team_id": team_id,
+        "storage_path": f"{team_id}/{file_name}",
+    }
+
+    async def _upload_markdown():
+        storage_response = await asyncio.to_thread(
+            lambda: supabase.storage.from_("user-documents").upload(
+                path=f"{team_id}/{file_name}",
+                file=markdown_bytes,
+                file_options={"content-type": "text/plain"},
+            )
+        )
+        if hasattr(storage_response, "error") and storage_response.error:
+            raise Exception(f"Storage upload failed: {storage_response.error}")
+
+    async def _embed_and_insert():
+        # Embed in batches under a semaphore — one call for typical pages,
+        # bounded concurrency for very large ones — then bulk-insert
+        texts = [chunk.page_content for chunk in chunks]
+
+        semaphore = asyncio.Semaphore(EMBED_MAX_CONCURRENCY)
+
+        async def _embed_batch(batch):
+            async with semaphore:
+                return await embeddings.aembed_documents(batch)
+
+        batches = [
+            texts[i : i + EMBED_BATCH_SIZE]
+            for i in range(0, len(texts), EMBED_BATCH_SIZE)
+        ]
+        batch_vectors = await asyncio.gather(*(_embed_batch(b) for b in batches))
+        vectors = [vector for batch in batch_vectors for vector in batch]
+
+        document_rows = [
+            {
+                "content": text,
+                "metadata": chunk.metadata,
+                "embedding": vector,
+            }
+            for text, chunk, vector in zip(texts, chunks, vectors)
+        ]
+
+        doc_response = await asyncio.to_thread(
+            lambda: supabase.table("documents").insert(document_rows).execute()
+        )
+        if hasattr(doc_response, "error") and doc_response.error:
+            raise Exception(f"Document insertion failed: {doc_response.error}")
+
+    async def _insert_file_metadata():
+        file_response = await asyncio.to_thread(
+            lambda: supabase.table("files").insert(file_data).execute()
+        )
+        if hasattr(file_response, "error") and file_response.error:
+            raise Exception(f"File data storage failed: {file_response.error}")
+
+    try:
+        # The three writes only depend on the crawl result, so run them
+        # concurrently instead of back to back
+        await asyncio.gather(
+            _upload_markdown(), _embed_and_insert(), _insert_file_metadata()
+        )
+
+        # Record the completed scrape so repeat requests can skip the crawl
+        await asyncio.to_thread(
+            lambda: supabase.table("scrape_cache")
+            .upsert(
+                {
+                    "cache_key": cache_key,
+                    "file_id": file_id,
+                    "storage_path": file_data["storage_path"],
+                    "created_at": datetime.now(timezone.utc).isoformat(),
+                },
+                on_conflict="cache_key",
+            )
+            .execute()
+        )
+    except Exception as e:
+        print(f"Error persisting scrape {file_id}: {str(e)}")
+
+
 @app.function()
 async def log_api_usage(usage_data: dict):
     """Asynchronous function to log API usage to Supabase."""
-    SUPABASE_URL = os.environ.get("SUPABASE_URL")
-    SUPABASE_KEY = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
-    supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+    supabase = get_supabase()
 
     try:
-        usage_response = supabase.table("api_usage_logs").insert(usage_data).execute()
+        usage_response = await asyncio.to_thread(
+            lambda: supabase.table("api_usage_logs").insert(usage_data).execute()
+        )
         if hasattr(usage_response, "error") and usage_response.error:
             print(f"Warning: Failed to log API usage: {usage_response.error}")
     except Exception as e:
@@ -50,12 +346,7 @@ async def log_api_usage(usage_data: dict):
 
 @web_app.post("/web_scrape")
 async def scrape_url(request: Request, data: ScrapeRequest):
-    import uuid
-    from crawl4ai import AsyncWebCrawler, BrowserConfig, CrawlerRunConfig, CacheMode
-
-    SUPABASE_URL = os.environ.get("SUPABASE_URL")
-    SUPABASE_KEY = os.environ.get("SUPABASE_SERVICE_ROLE_KEY")
-    supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+    user_id = None
 
     try:
         auth_header = request.headers.get("authorization")
@@ -64,119 +355,95 @@ async def scrape_url(request: Request, data: ScrapeRequest):
                 status_code=401, detail="Authorization header is required"
             )
 
-        try:
-            uuid.UUID(auth_header)
-        except ValueError:
+        if not _UUID_RE.match(auth_header):
             raise HTTPException(
                 status_code=401, detail="Invalid authorization header format"
             )
 
-        # Validate API key with Supabase
-        response = (
-            supabase.table("api_keys")
-            .select("team_id, user_id, profiles(email)")
-            .eq("api_key", auth_header)
-            .single()
-            .execute()
-        )
-
-        if not response.data or not response.data.get("team_id"):
-            raise HTTPException(status_code=401, detail="Invalid API key")
-
-        team_id = response.data["team_id"]
-
-        async with AsyncWebCrawler(config=BrowserConfig(headless=True)) as crawler:
-            result = await crawler.arun(
-                data.url,
-                config=CrawlerRunConfig(
-                    cache_mode=CacheMode.BYPASS,
-                    page_timeout=80000,
-                ),
-            )
-
-            file_id = str(uuid.uuid4())
-            file_name = f"{file_id}.txt"
-
-            text_splitter = RecursiveCharacterTextSplitter(
-                chunk_size=data.chunk_size, chunk_overlap=data.chunk_overlap
-            )
-
-            chunks = text_splitter.create_documents(
-                texts=[result.markdown],
-                metadatas=[{"source": data.url, "file_id": file_id}],
-            )
-
-            markdown_bytes = result.markdown.encode("utf-8")
+        # Validate API key (cached; only misses hit Supabase)
+        key_data = await validate_api_key(auth_header)
+        team_id = key_data["team_id"]
+        user_id = key_data["user_id"]
 
-            storage_response = supabase.storage.from_("user-documents").upload(
-                path=f"{team_id}/{file_name}",
-                file=markdown_bytes,
-                file_options={"content-type": "text/plain"},
-            )
-
-            if hasattr(storage_response, "error") and storage_response.error:
-                raise Exception(f"Storage upload failed: {storage_response.error}")
-
-            embeddings = OpenAIEmbeddings(
-                model="text-embedding-3-small",
-            )
-
-            # Insert documents directly using Supabase client
-            for chunk in chunks:
-                embedding_vector = await embeddings.aembed_documents(
-                    [chunk.page_content]
-                )
-                document_data = {
-                    "content": chunk.page_content,
-                    "metadata": chunk.metadata,
-                    "embedding": embedding_vector[0],
+        # Serve a recent identical scrape from cache instead of re-crawling
+        cache_key = _scrape_cache_key(
+            team_id, data.url, data.chunk_size, data.chunk_overlap
+        )
+        cached = await lookup_scrape_cache(cache_key)
+        if cached:
+            log_api_usage.spawn(
+                {
+                    "user_id": user_id,
+                    "endpoint": "/web_scrape",
+                    "success": True,
+                    "error": None,
                 }
-                doc_response = (
-                    supabase.table("documents").insert(document_data).execute()
-                )
-                if hasattr(doc_response, "error") and doc_response.error:
-                    raise Exception(f"Document insertion failed: {doc_response.error}")
-
-            # Store file data in Supabase database
-            file_data = {
-                "file_id": file_id,
-                "type": "web_scrape",
-                "file_name": file_name,
-                "team_id": team_id,
-                "storage_path": f"{team_id}/{file_name}",
+            )
+            return {
+                "success": True,
+                "message": "Web scrape served from cache",
+                "file_id": cached["file_id"],
+                "storage_path": cached["storage_path"],
+                "cached": True,
             }
 
-            file_response = supabase.table("files").insert(file_data).execute()
-
-            if hasattr(file_response, "error") and file_response.error:
-                raise Exception(f"File data storage failed: {file_response.error}")
+        # Crawl on a warm Scraper container that reuses its browser
+        markdown = await Scraper().crawl.remote.aio(data.url) or ""
+
+        # Nothing extracted: skip the storage upload, embeddings and DB
+        # writes entirely and log a distinct failure
+        if not markdown.strip():
+            log_api_usage.spawn(
+                {
+                    "user_id": user_id,
+                    "endpoint": "/web_scrape",
+                    "success": False,
+                    "error": "empty_markdown",
+                }
+            )
+            return {"error": "No content extracted from URL", "status_code": 422}
+
+        file_id = str(uuid.uuid4())
+        file_name = f"{file_id}.txt"
+
+        # Persist storage + embeddings + metadata in the background; the
+        # client only needs the crawl result and file_id
+        persist_scrape.spawn(
+            team_id,
+            file_id,
+            markdown,
+            data.url,
+            data.chunk_size,
+            data.chunk_overlap,
+            cache_key,
+        )
 
-            response_data = {
-                "success": True,
-                "markdown": result.markdown,
-                "message": "Web scrape completed successfully",
-                "file_id": file_id,
-            }
+        # Compact by default: the markdown can be several MB and clients can
+        # fetch it from storage; opt in with ?include=markdown
+        response_data = {
+            "success": True,
+            "message": "Web scrape completed successfully",
+            "file_id": file_id,
+            "storage_path": f"{team_id}/{file_name}",
+        }
+        if request.query_params.get("include") == "markdown":
+            response_data["markdown"] = markdown
 
-            usage_data = {
-                "user_id": response.data["user_id"],
-                "endpoint": "/web_scrape",
-                "success": True,
-                "error": None,
-            }
+        usage_data = {
+            "user_id": user_id,
+            "endpoint": "/web_scrape",
+            "success": True,
+            "error": None,
+        }
 
-            # Spawn logging process asynchronously
-            log_api_usage.spawn(usage_data)
+        # Spawn logging process asynchronously
+        log_api_usage.spawn(usage_data)
 
-            return response_data
+        return response_data
     except HTTPException as e:
         # Log failed API usage for HTTP exceptions
         error_usage_data = {
-            "user_id": (
-                response.data["user_id"]
-                if "response" in locals() and response.data
-                else None
-            ),
+            "user_id": user_id,
             "endpoint": "/web_scrape",
             "success": False,
             "error": e.detail,
@@ -185,11 +452,7 @@ async def scrape_url(request: Request, data: ScrapeRequest):
         return {"error": e.detail, "status_code": e.status_code}
     except Exception as e:
         error_usage_data = {
-            "user_id": (
-                response.data["user_id"]
-                if "response" in locals() and response.data
-                else None
-            ),
+            "user_id": user_id,
             "endpoint": "/web_scrape",
             "success": False,
             "error": str(e),
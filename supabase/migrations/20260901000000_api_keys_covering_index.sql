@@ -0,0 +1,14 @@
+-- Covering index for the per-request API-key lookup.
+--
+-- /web_scrape resolves `SELECT team_id, user_id FROM api_keys WHERE
+-- api_key = $1` on every cache miss; including both columns lets Postgres
+-- answer it with an index-only scan instead of a heap fetch.
+--
+-- Run with CONCURRENTLY (outside a transaction) if api_keys is under live
+-- write load:
+--   CREATE UNIQUE INDEX CONCURRENTLY IF NOT EXISTS api_keys_api_key_covering
+--     ON api_keys (api_key) INCLUDE (team_id, user_id);
+
+CREATE UNIQUE INDEX IF NOT EXISTS api_keys_api_key_covering
+    ON api_keys (api_key)
+    INCLUDE (team_id, user_id);
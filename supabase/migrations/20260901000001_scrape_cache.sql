@@ -0,0 +1,13 @@
+-- Cache of completed scrapes keyed by (team, url, chunking shape).
+--
+-- /web_scrape consults this before crawling: a row younger than the TTL
+-- lets the API return the prior file_id/storage_path without re-launching
+-- the browser or re-embedding. Rows are upserted by persist_scrape after a
+-- successful write, refreshing created_at.
+
+CREATE TABLE IF NOT EXISTS scrape_cache (
+    cache_key text PRIMARY KEY,
+    file_id uuid NOT NULL,
+    storage_path text NOT NULL,
+    created_at timestamptz NOT NULL DEFAULT now()
+);